@@ -1,5 +1,6 @@
 import anndata as ad
 import numpy as np
+import numpy.typing as npt
 import pandas as pd
 from scipy.sparse import issparse
 from typing import (
@@ -43,18 +44,104 @@ class BaseOTModel:
         normalize: bool = True,
         norm_axis: int = None,
     ) -> ad.AnnData:
-        tmap = self.get_coupling(t0, t1)
-        if issparse(tmap.X):
-            tmap.X = tmap.X.toarray()
-        if normalize:
-            tmap.X = tmap.X / tmap.X.sum(norm_axis, keepdims=True)
+        x1, obs_names = self.push_forward_array(
+            p.X, p.obs_names, t0, t1, normalize=normalize, norm_axis=norm_axis
+        )
         p1 = ad.AnnData(pd.DataFrame(
-            tmap[p.obs_names, :].X.T @ p.X,
+            x1,
             columns=p.var_names,
-            index=tmap.var_names,
+            index=obs_names,
         ))
         return p1
 
+    def push_forward_array(
+        self,
+        x: npt.NDArray,
+        obs_names: pd.Index,
+        t0: int,
+        t1: int,
+        normalize: bool = True,
+        norm_axis: int = None,
+    ) -> Tuple[npt.NDArray, pd.Index]:
+        """Push forward a plain array whose rows are the cells obs_names.
+
+        Returns the pushed-forward array and the names of its rows (the
+        cells at t1), without building intermediate AnnData objects. The
+        coupling returned by get_coupling is not modified.
+        """
+        tmap = self.get_coupling(t0, t1)
+        X = tmap.X
+        if issparse(X):
+            X = X.toarray()
+        if normalize:
+            X = X / X.sum(norm_axis, keepdims=True)
+        X = X[self._get_indexer(tmap.obs_names, obs_names), :]
+        return X.T @ x, tmap.var_names
+
+    def push_forward_both_norms(
+        self,
+        p_out: ad.AnnData,
+        p_in: ad.AnnData,
+        t0: int,
+        t1: int,
+    ) -> Tuple[ad.AnnData, ad.AnnData]:
+        """Push forward with row- and column-normalized couplings at once.
+
+        Equivalent to push_forward(p_out, ..., norm_axis=1) and
+        push_forward(p_in, ..., norm_axis=0). p_out and p_in must share
+        obs_names. See push_forward_both_norms_array.
+        """
+        if not p_out.obs_names.equals(p_in.obs_names):
+            raise ValueError('p_out and p_in must have the same obs_names')
+        x1_out, x1_in, obs_names = self.push_forward_both_norms_array(
+            p_out.X, p_in.X, p_out.obs_names, t0, t1
+        )
+        p1_out = ad.AnnData(pd.DataFrame(
+            x1_out,
+            columns=p_out.var_names,
+            index=obs_names,
+        ))
+        p1_in = ad.AnnData(pd.DataFrame(
+            x1_in,
+            columns=p_in.var_names,
+            index=obs_names,
+        ))
+        return p1_out, p1_in
+
+    def push_forward_both_norms_array(
+        self,
+        x_out: npt.NDArray,
+        x_in: npt.NDArray,
+        obs_names: pd.Index,
+        t0: int,
+        t1: int,
+    ) -> Tuple[npt.NDArray, npt.NDArray, pd.Index]:
+        """Array version of push_forward_both_norms.
+
+        The coupling is loaded once and both products are computed in a
+        single matmul, by moving the row normalization onto x_out and the
+        column normalization onto the result. Both returned arrays are
+        C-contiguous copies, not views of the stacked product.
+        """
+        tmap = self.get_coupling(t0, t1)
+        col_sums = np.asarray(tmap.X.sum(0)).ravel()
+        X = tmap.X[self._get_indexer(tmap.obs_names, obs_names), :]
+        if issparse(X):
+            X = X.toarray()
+        row_sums = X.sum(1, keepdims=True)
+        n_out = x_out.shape[1]
+        x1 = X.T @ np.hstack((x_out / row_sums, x_in))
+        x1_out = np.ascontiguousarray(x1[:, :n_out])
+        x1_in = x1[:, n_out:] / col_sums[:, None]
+        return x1_out, x1_in, tmap.var_names
+
+    @staticmethod
+    def _get_indexer(names: pd.Index, cells: pd.Index) -> npt.NDArray:
+        ix = names.get_indexer(cells)
+        if (ix < 0).any():
+            raise KeyError('cells not found in coupling')
+        return ix
+
     def pull_back(
         self,
         p: ad.AnnData,
@@ -63,18 +150,39 @@ class BaseOTModel:
         normalize: bool = True,
         norm_axis: int = None,
     ) -> ad.AnnData:
-        tmap = self.get_coupling(t0, t1)
-        if issparse(tmap.X):
-            tmap.X = tmap.X.toarray()
-        if normalize:
-            tmap.X = tmap.X / tmap.X.sum(norm_axis, keepdims=True)
+        x1, obs_names = self.pull_back_array(
+            p.X, p.obs_names, t0, t1, normalize=normalize, norm_axis=norm_axis
+        )
         p1 = ad.AnnData(pd.DataFrame(
-            tmap[:, p.obs_names].X @ p.X,
+            x1,
             columns=p.var_names,
-            index=tmap.obs_names,
+            index=obs_names,
         ))
         return p1
 
+    def pull_back_array(
+        self,
+        x: npt.NDArray,
+        obs_names: pd.Index,
+        t0: int,
+        t1: int,
+        normalize: bool = True,
+        norm_axis: int = None,
+    ) -> Tuple[npt.NDArray, pd.Index]:
+        """Pull back a plain array whose rows are the cells obs_names.
+
+        Returns the pulled-back array and the names of its rows (the cells
+        at t0). The coupling returned by get_coupling is not modified.
+        """
+        tmap = self.get_coupling(t0, t1)
+        X = tmap.X
+        if issparse(X):
+            X = X.toarray()
+        if normalize:
+            X = X / X.sum(norm_axis, keepdims=True)
+        X = X[:, self._get_indexer(tmap.var_names, obs_names)]
+        return X @ x, tmap.obs_names
+
 
 class MoscotModel(BaseOTModel):
     """Moscot trajectory model"""
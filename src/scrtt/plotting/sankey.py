@@ -1,25 +1,195 @@
-import anndata as ad
+import hashlib
+import itertools
+import os
+import tempfile
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from typing import Union, Literal, Dict, List, Tuple
+import threading
+from joblib import Parallel, delayed
+from scipy.sparse import csr_matrix, issparse
+from scipy.special import xlogy
+from functools import wraps
+from pathlib import Path
+from typing import Union, Literal, Dict, List, Optional, Tuple
 from scrtt.models.trajectory import OTModel
 from scrtt.utils import window
 from ._flowplot import plot_flows
 
 
-def _calculate_entropy(x):
-    x /= x.sum()
-    return -np.sum(x * np.log(x))
+def _entropy_from_sums(total: npt.NDArray, xlogx: npt.NDArray) -> npt.NDArray:
+    """Entropy given S = sum(x) and sum(x * log(x)) over each group.
 
+    Uses H = log(S) - sum(x * log(x)) / S, so x never has to be normalized.
+    0 * log(0) is taken to be 0, and groups with no mass have entropy 0.
+    The subtraction cancels for single-member groups, so the result is
+    clamped at 0 to avoid tiny negative entropies.
+    """
+    total = np.where(total > 0, total, np.nan)
+    entropy = np.nan_to_num(np.log(total) - xlogx / total, nan=0.0)
+    return np.maximum(entropy, 0.0)
+
+
+def _expected_flow_entropy(pair_codes, n_pairs, group_codes, n_groups, flow):
+    """Size-weighted mean of group entropies within each (t0, t1) pair.
+
+    Flows are summed per (pair, group) with np.bincount over the combined
+    code pair * n_groups + group. Returns the weighted entropies along with
+    the (n_pairs, n_groups) group sizes, which are reused for the prior
+    entropy calculation.
+    """
+    codes = pair_codes * n_groups + group_codes
+    n_bins = n_pairs * n_groups
+    sizes = np.bincount(codes, weights=flow, minlength=n_bins)
+    xlogx = np.bincount(codes, weights=xlogy(flow, flow), minlength=n_bins)
+    sizes = sizes.reshape(n_pairs, n_groups)
+    entropy = _entropy_from_sums(sizes, xlogx.reshape(n_pairs, n_groups))
+    weights = sizes / sizes.sum(1, keepdims=True)
+    return np.nansum(weights * entropy, axis=1), sizes
+
+
+def _prior_entropy(sizes: npt.NDArray) -> npt.NDArray:
+    return _entropy_from_sums(sizes.sum(1), xlogy(sizes, sizes).sum(1))
+
+
+def _project_flow(x, s1) -> npt.NDArray:
+    """Compute x.T @ s1, normalized to total mass 1.
+
+    x is the dense pushed-forward array and s1 may be sparse.
+    """
+    if issparse(s1):
+        flow = np.asarray(s1.T.dot(x).T)
+    else:
+        flow = x.T @ s1
+    flow *= 1.0 / flow.sum()
+    return flow
 
-def _expected_flow_entropy(flow_df, group_var, flow_var):
-    weights = flow_df.groupby(group_var)[flow_var].sum()
-    weights /= weights.sum()
-    entropy = flow_df.groupby(group_var)[flow_var].apply(_calculate_entropy)
-    return np.nansum(weights * entropy)
+
+def _pad_rows(x: npt.NDArray, ix: npt.NDArray, n_rows: int) -> npt.NDArray:
+    """Place the rows of x at rows ix (indices or mask) of a zero array."""
+    padded = np.zeros((n_rows, x.shape[1]), dtype=x.dtype)
+    padded[ix, :] = x
+    return padded
+
+
+def _hash_update(h, X):
+    """Feed a dense or sparse matrix X into the hashlib object h."""
+    if issparse(X):
+        X = X.tocsr()
+        arrays = (
+            X.indptr.astype(np.int64),
+            X.indices.astype(np.int64),
+            X.data,
+        )
+    else:
+        X = np.asarray(X)
+        arrays = (np.ascontiguousarray(X),)
+    h.update(repr((issparse(X), X.shape, str(X.dtype))).encode())
+    for array in arrays:
+        h.update(array.tobytes())
+
+
+def _hash_index(h, index: pd.Index):
+    h.update(pd.util.hash_pandas_object(index).values.tobytes())
+
+
+def _disk_memoize(func):
+    """Memoize a Sankey flow calculation on disk, in `self.cache_dir`.
+
+    Flows are keyed by a hash of (t0, t1), the subsets, the cells at t0 and
+    t1, and the couplings between them, so the key changes whenever any of
+    the inputs to the flows do.
+    """
+
+    @wraps(func)
+    def wrapper(self, t0, t1):
+        if self.cache_dir is None:
+            return func(self, t0, t1)
+        path = self.cache_dir / f'flows_{self._flow_cache_key(t0, t1)}.pkl'
+        if path.exists():
+            flow_df = pd.read_pickle(path)
+            # The cached flows may come from a Sankey with another
+            # group_order, so re-cast the labels to this one's categories.
+            categories = self._labels.categories
+            for var in ('source', 'target'):
+                flow_df[var] = pd.Categorical(
+                    flow_df[var], categories=categories
+                )
+            if self.cache_flow_dfs:
+                self._store_flow(t0, t1, flow_df)
+            return flow_df
+        flow_df = func(self, t0, t1)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and move it into place, so that a crash or a
+        # concurrent writer never leaves a truncated pickle at path.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                flow_df.to_pickle(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return flow_df
+
+    return wrapper
+
+
+# Source of FlowDict versions, unique across all FlowDicts.
+_flow_versions = itertools.count(1)
+
+
+class _FlowDict(dict):
+    """Dict of flow dfs that takes a new `version` whenever it is modified.
+
+    Caches derived from the flows compare against `version`, so they are
+    invalidated by any insertion, replacement or removal of a flow df.
+    Modifying a flow df in place is not tracked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bump()
+
+    def _bump(self):
+        self.version = next(_flow_versions)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._bump()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._bump()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._bump()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._bump()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._bump()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._bump()
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._bump()
+        return value
 
 
 class Sankey:
@@ -34,17 +204,51 @@ class Sankey:
             palette: str = None,
             endpoint_width: float = 0.05,
             cache_flow_dfs: bool = True,
+            cache_dir: Optional[Path] = None,
     ):
+        """Set up Sankey plots of subsets of the cells in ot_model.
+
+        Args:
+            ot_model (OTModel): trajectory model providing the couplings.
+            subsets (pd.DataFrame or pd.Series): cells by subsets weights,
+                or a Series of subset labels for each cell.
+            color_dict (dict): colors for each subset.
+            group_order (list): order of the subsets in the plots.
+            palette (str): seaborn palette used if color_dict is not given.
+            endpoint_width (float): width of the flow endpoints.
+            cache_flow_dfs (bool): keep calculated flows in flow_dfs.
+            cache_dir (Path): optional directory in which calculated flows
+                are pickled and reused across sessions. Files are keyed by a
+                hash of the subsets and of the couplings used, so computing
+                a key loads those couplings. Cached files are read with
+                pd.read_pickle, which can execute arbitrary code, so only
+                use a directory that nobody else can write to.
+        """
         self.ot_model = ot_model
         if isinstance(subsets, pd.Series):
             subsets = pd.get_dummies(subsets).astype(float)
         else:
             subsets = subsets.astype(float)
         subsets.columns = subsets.columns.astype(str)
-        self.subsets = subsets
+        # Only the subsets matrix and its index and columns are kept. One-hot
+        # subsets (e.g. from a Series of labels) are stored as CSR, without a
+        # dense copy, so slicing and the final flow projection stay sparse.
+        self._subsets_index = subsets.index
+        self._subsets_columns = subsets.columns
+        if np.isin(subsets.values, (0, 1)).all():
+            self._subsets_matrix = csr_matrix(subsets.values)
+        else:
+            self._subsets_matrix = subsets.values
         if group_order is None:
             group_order = subsets.columns.tolist()
         self.group_order = group_order
+        # Flow source/target labels are categoricals ordered by group_order.
+        self._labels = pd.Categorical(
+            subsets.columns,
+            categories=list(group_order) + [
+                c for c in subsets.columns if c not in group_order
+            ],
+        )
         if color_dict is None:
             pal = sns.color_palette(palette=palette, n_colors=len(group_order))
             color_dict = dict(zip(group_order, pal))
@@ -55,6 +259,44 @@ class Sankey:
             self.flow_dfs = dict()
         else:
             self.flow_dfs = None
+        # Derived from flow_dfs, as (flow version, value) pairs.
+        self._all_flows_cache: Tuple[int, pd.DataFrame] = (None, None)
+        self._metrics_cache: Dict[str, Tuple[int, pd.DataFrame]] = {}
+        # Pushed-forward t0 subsets, reused as prefixes of longer intervals.
+        # Only the longest interval computed so far is kept for each t0.
+        self._pf_cache: Dict[Tuple, Tuple[npt.NDArray, ...]] = {}
+        # Guards cache writes when flows are computed in parallel threads.
+        self._lock = threading.Lock()
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._subsets_hash = None
+        self._coupling_hashes: Dict[Tuple, str] = {}
+        # The per-time slices together hold one more copy of the subsets
+        # matrix rows (sparse for one-hot subsets).
+        self._ix_by_time = None
+        self._subsets_by_time = dict()
+
+    @property
+    def subsets(self) -> pd.DataFrame:
+        """Dense cells x subsets DataFrame, rebuilt on each access."""
+        X = self._subsets_matrix
+        return pd.DataFrame(
+            X.toarray() if issparse(X) else X,
+            index=self._subsets_index,
+            columns=self._subsets_columns,
+        )
+
+    @property
+    def flow_dfs(self) -> Optional[Dict[Tuple, pd.DataFrame]]:
+        """Cached flow dfs, keyed by (t0, t1)."""
+        return self._flow_dfs
+
+    @flow_dfs.setter
+    def flow_dfs(self, flow_dfs: Optional[Dict[Tuple, pd.DataFrame]]):
+        self._flow_dfs = None if flow_dfs is None else _FlowDict(flow_dfs)
+
+    @property
+    def _flow_version(self) -> int:
+        return self.flow_dfs.version
 
     def plot_all_transitions(
             self,
@@ -63,8 +305,15 @@ class Sankey:
             min_flow_threshold: float = None,
             figsize: Tuple = None,
             endpoint_linewidth: float = None,
+            n_jobs: Optional[int] = None,
     ):
-        """Plot all consecutive transitions in a single fig."""
+        """Plot all consecutive transitions in a single fig.
+
+        If n_jobs is set, the missing flows are first computed in that
+        many threads (joblib n_jobs semantics); the coupling matmuls release
+        the GIL. Each thread holds a dense coupling in memory, so keep this
+        small for large models. Requires cache_flow_dfs=True.
+        """
 
         day_pairs = self.ot_model.day_pairs
         if timepoints is None:
@@ -72,6 +321,16 @@ class Sankey:
         timepoints = list(sorted(timepoints))
         n_timepoints = len(timepoints)
         timepoints = dict(zip(timepoints, range(n_timepoints)))
+        if n_jobs is not None and not self.cache_flow_dfs:
+            raise ValueError('n_jobs requires cache_flow_dfs=True')
+
+        # Compute the missing flows up front in parallel; plot_sankey then
+        # only reads them from the cache.
+        if n_jobs is not None:
+            missing = [dp for dp in day_pairs if dp not in self.flow_dfs]
+            Parallel(n_jobs=n_jobs, backend='threading')(
+                delayed(self.calculate_flows)(*dp) for dp in missing
+            )
 
         fig = plt.figure(figsize=figsize)
         for i, day_pair in enumerate(day_pairs):
@@ -149,6 +408,7 @@ class Sankey:
         )
         return ax
 
+    @_disk_memoize
     def calculate_flows(
             self,
             t0: float,
@@ -156,36 +416,112 @@ class Sankey:
     ) -> pd.DataFrame:
         """Calculate flow df for subsets between t0 and t1."""
 
-        meta = self.ot_model.meta
-        ix_t0 = meta.index[meta[self.ot_model.time_var] == t0]
-        ix_t1 = meta.index[meta[self.ot_model.time_var] == t1]
-        s0 = self.subsets.loc[ix_t0, :]
-        s1 = self.subsets.loc[ix_t1, :]
-        s0 = s0 / s0.values.sum()
-        s1 = s1 / s1.values.sum()
+        # The push forwards and projection are linear, and _project_flow
+        # normalizes the result, so s0 and s1 are used unnormalized.
+        s0 = self._subsets_at(t0)
+        s1 = self._subsets_at(t1)
+        columns = self._subsets_columns
+        # Subsets and cells with no mass at t0 contribute nothing to the
+        # push forward, so drop them and pad the flows back afterwards.
+        col_mask = np.asarray(s0.sum(axis=0)).ravel() > 0
         tps = np.array(self.ot_model.timepoints)
-        day_pairs = window(tps[(tps >= t0) & (tps <= t1)])
-        outflow = ad.AnnData(s0)
-        inflow = ad.AnnData(s0)
+        # Resume from the longest cached push forward of s0 within [t0, t1].
+        with self._lock:
+            cached = [
+                tk for (ti, tk) in self._pf_cache if ti == t0 and tk <= t1
+            ]
+            if cached:
+                t_k = max(cached)
+                outflow, inflow, obs_names = self._pf_cache[(t0, t_k)]
+        if not cached:
+            t_k = t0
+            row_mask = np.asarray(s0.sum(axis=1)).ravel() > 0
+            if t1 == t0:
+                row_mask[:] = True
+            p0 = s0[row_mask][:, col_mask]
+            outflow = inflow = p0.toarray() if issparse(p0) else p0
+            obs_names = self._ix_by_time[t0][row_mask]
+        day_pairs = window(tps[(tps >= t_k) & (tps <= t1)])
         for day_pair in day_pairs:
-            outflow = self.ot_model.push_forward(
-                outflow, *day_pair, normalize=True, norm_axis=1
+            outflow, inflow, obs_names = (
+                self.ot_model.push_forward_both_norms_array(
+                    outflow, inflow, obs_names, *day_pair
+                )
             )
-            inflow = self.ot_model.push_forward(
-                inflow, *day_pair, normalize=True, norm_axis=0
-            )
-        outflow = outflow.X.T @ s1.values
-        outflow = outflow / outflow.sum()
-        inflow = inflow.X.T @ s1.values
-        inflow = inflow / inflow.sum()
-        outflow = self._format_flow(outflow, s0, s1, name='outflow')
-        inflow = self._format_flow(inflow, s0, s1, name='inflow')
-        flow_df = pd.merge(outflow, inflow, on=['source', 'target'])
+        # Only worth keeping if a longer interval from t0 can follow.
+        if self.cache_flow_dfs and t1 < tps.max():
+            with self._lock:
+                prev = [tk for (ti, tk) in self._pf_cache if ti == t0]
+                if all(tk < t1 for tk in prev):
+                    for tk in prev:
+                        del self._pf_cache[(t0, tk)]
+                    self._pf_cache[(t0, t1)] = (outflow, inflow, obs_names)
+        outflow = _pad_rows(_project_flow(outflow, s1), col_mask, len(columns))
+        inflow = _pad_rows(_project_flow(inflow, s1), col_mask, len(columns))
+        labels = self._labels
+        outflow = self._format_flow(outflow, labels, labels, name='outflow')
+        inflow = self._format_flow(inflow, labels, labels, name='inflow')
+        # Both frames share the same (source, target) row order.
+        flow_df = outflow.assign(inflow=inflow['inflow'].values)
 
         if self.cache_flow_dfs:
-            self.flow_dfs[(t0, t1)] = flow_df
+            self._store_flow(t0, t1, flow_df)
         return flow_df
 
+    def _subsets_at(self, t: float):
+        """Subsets matrix rows for cells at time t, cached across calls."""
+        if t not in self._subsets_by_time:
+            rows = self._subsets_index.get_indexer(self._cells_at(t))
+            if (rows < 0).any():
+                raise KeyError(f'subsets are missing cells at time {t}')
+            self._subsets_by_time[t] = self._subsets_matrix[rows]
+        return self._subsets_by_time[t]
+
+    def _cells_at(self, t: float) -> pd.Index:
+        if self._ix_by_time is None:
+            meta = self.ot_model.meta
+            self._ix_by_time = meta.groupby(self.ot_model.time_var).groups
+        return self._ix_by_time[t]
+
+    def _store_flow(self, t0: float, t1: float, flow_df: pd.DataFrame):
+        with self._lock:
+            self.flow_dfs[(t0, t1)] = flow_df
+
+    def _flow_cache_key(self, t0: float, t1: float) -> str:
+        """Hash identifying the flows between t0 and t1 across sessions."""
+        if self._subsets_hash is None:
+            h = hashlib.sha1()
+            _hash_update(h, self._subsets_matrix)
+            _hash_index(h, self._subsets_index)
+            h.update(repr(self._subsets_columns.tolist()).encode())
+            self._subsets_hash = h.hexdigest()
+        h = hashlib.sha1(self._subsets_hash.encode())
+        _hash_index(h, self._cells_at(t0))
+        _hash_index(h, self._cells_at(t1))
+        tps = np.array(self.ot_model.timepoints)
+        day_pairs = window(tps[(tps >= t0) & (tps <= t1)])
+        # Times are keyed as floats, so that e.g. 1, 1.0 and np.int64(1)
+        # give the same key.
+        times = [float(t0), float(t1)]
+        couplings = [
+            (float(ti), float(tj), self._coupling_hash(ti, tj))
+            for ti, tj in day_pairs
+        ]
+        h.update(repr((times, couplings)).encode())
+        return h.hexdigest()
+
+    def _coupling_hash(self, t0: float, t1: float) -> str:
+        """Hash of the coupling between t0 and t1, computed once per pair."""
+        key = (float(t0), float(t1))
+        if key not in self._coupling_hashes:
+            tmap = self.ot_model.get_coupling(t0, t1)
+            h = hashlib.sha1()
+            _hash_update(h, tmap.X)
+            _hash_index(h, tmap.obs_names)
+            _hash_index(h, tmap.var_names)
+            self._coupling_hashes[key] = h.hexdigest()
+        return self._coupling_hashes[key]
+
     # def compute_metrics(self) -> pd.DataFrame:
     #     """Compute evaluation metrics for clusters given OT model.
 
@@ -213,76 +549,127 @@ class Sankey:
     #     )
     #     return results
 
-    def compute_flow_consistency(self):
+    def _time_keys(self) -> List[str]:
         time_var = self.ot_model.time_var
-        time_keys = [f'{time_var}_0', f'{time_var}_1']
-        flow_df = pd.concat(
-            self.flow_dfs.values(),
-            axis=0,
-            keys=self.flow_dfs.keys(),
-            names=time_keys,
-        )
-        flow_df = flow_df.loc[flow_df['source'] == flow_df['target'], :]
-        flow_df.drop(['source', 'target'], axis=1, inplace=True)
-        consistency = flow_df.groupby(time_keys).sum()
-        consistency = consistency.rename(
-            {'outflow': 'forward', 'inflow': 'backward'}, axis=1
-        ).melt(
-            var_name='direction', value_name='consistency', ignore_index=False
-        ).reset_index()
-        return consistency
+        return [f'{time_var}_0', f'{time_var}_1']
+
+    @property
+    def _all_flows(self) -> pd.DataFrame:
+        """Cached flow dfs concatenated and indexed by (t0, t1).
+
+        Rebuilt only when flow_dfs has been modified since the last call.
+        """
+        version = self._flow_version
+        if self._all_flows_cache[0] != version:
+            all_flows = pd.concat(
+                self.flow_dfs.values(),
+                axis=0,
+                keys=self.flow_dfs.keys(),
+                names=self._time_keys(),
+            )
+            self._all_flows_cache = (version, all_flows)
+        return self._all_flows_cache[1]
+
+    def _cached_metric(self, name: str) -> Optional[pd.DataFrame]:
+        """Metric computed from the current flow_dfs, or None if stale."""
+        version, metric = self._metrics_cache.get(name, (None, None))
+        return metric if version == self._flow_version else None
+
+    def compute_flow_consistency(self):
+        consistency = self._cached_metric('consistency')
+        if consistency is None:
+            version = self._flow_version
+            time_keys = self._time_keys()
+            flow_df = self._all_flows
+            is_self_flow = (flow_df['source'] == flow_df['target']).values
+            sums = flow_df.loc[is_self_flow, ['outflow', 'inflow']].groupby(
+                time_keys
+            ).sum()
+            # Long format, with all forward rows followed by backward rows.
+            n = len(sums)
+            consistency = pd.DataFrame({
+                time_keys[0]: np.tile(sums.index.get_level_values(0), 2),
+                time_keys[1]: np.tile(sums.index.get_level_values(1), 2),
+                'direction': np.repeat(['forward', 'backward'], n),
+                'consistency': np.concatenate(
+                    (sums['outflow'].values, sums['inflow'].values)
+                ),
+            })
+            self._metrics_cache['consistency'] = (version, consistency)
+        return consistency.copy()
 
     def compute_flow_entropy(self):
-        time_var = self.ot_model.time_var
-        time_keys = [f'{time_var}_0', f'{time_var}_1']
-        flow_df = pd.concat(
-            self.flow_dfs.values(),
-            axis=0,
-            keys=self.flow_dfs.keys(),
-            names=time_keys,
-        )
-        expected_entropy_out = flow_df.groupby(time_keys).apply(
-            lambda df: _expected_flow_entropy(df, 'source', 'outflow')
-        )
-        expected_entropy_in = flow_df.groupby(time_keys).apply(
-            lambda df: _expected_flow_entropy(df, 'target', 'inflow')
-        )
-        expected_entropy = pd.concat(
-            [expected_entropy_out, expected_entropy_in],
-            axis=0,
-            keys=['forward', 'backward'],
-            names=['direction'],
-        )
+        entropy = self._cached_metric('entropy')
+        if entropy is None:
+            version = self._flow_version
+            time_keys = self._time_keys()
+            flow_df = self._all_flows
+            # Integer codes for each (t0, t1) pair, from the index codes.
+            index = flow_df.index
+            n1 = len(index.levels[1])
+            pairs, pair_codes = np.unique(
+                index.codes[0].astype(np.int64) * n1 + index.codes[1],
+                return_inverse=True,
+            )
+            pair_index = pd.MultiIndex.from_arrays(
+                [index.levels[0][pairs // n1], index.levels[1][pairs % n1]],
+                names=time_keys,
+            )
+            n_pairs = len(pair_index)
+            src_codes, sources = pd.factorize(flow_df['source'])
+            tgt_codes, targets = pd.factorize(flow_df['target'])
+            src_entropy, src_sizes = _expected_flow_entropy(
+                pair_codes, n_pairs, src_codes, len(sources),
+                flow_df['outflow'].values,
+            )
+            tgt_entropy, tgt_sizes = _expected_flow_entropy(
+                pair_codes, n_pairs, tgt_codes, len(targets),
+                flow_df['inflow'].values,
+            )
 
-        src_sizes = flow_df.groupby(time_keys + ['source'])['outflow'].sum()
-        src_entropy = src_sizes.groupby(time_keys).apply(_calculate_entropy)
-        tgt_sizes = flow_df.groupby(time_keys + ['target'])['inflow'].sum()
-        tgt_entropy = tgt_sizes.groupby(time_keys).apply(_calculate_entropy)
-        prior_entropy = pd.concat(
-            [tgt_entropy, src_entropy],
-            axis=0,
-            keys=['forward', 'backward'],
-            names=['direction'],
-        )
+            expected_entropy = pd.concat(
+                [
+                    pd.Series(src_entropy, index=pair_index),
+                    pd.Series(tgt_entropy, index=pair_index),
+                ],
+                axis=0,
+                keys=['forward', 'backward'],
+                names=['direction'],
+            )
+            prior_entropy = pd.concat(
+                [
+                    pd.Series(_prior_entropy(tgt_sizes), index=pair_index),
+                    pd.Series(_prior_entropy(src_sizes), index=pair_index),
+                ],
+                axis=0,
+                keys=['forward', 'backward'],
+                names=['direction'],
+            )
 
-        results = pd.DataFrame({
-            'expected': expected_entropy,
-            'prior': prior_entropy,
-        })
-        return results
+            entropy = pd.DataFrame({
+                'expected': expected_entropy,
+                'prior': prior_entropy,
+            })
+            self._metrics_cache['entropy'] = (version, entropy)
+        return entropy.copy()
 
     @staticmethod
     def _format_flow(
             flow: npt.NDArray,
-            p0: pd.DataFrame,
-            p1: pd.DataFrame,
+            sources: pd.Categorical,
+            targets: pd.Categorical,
             name: Literal['inflow', 'outflow'],
     ) -> pd.DataFrame:
-        df = pd.DataFrame(
-            flow, index=p0.columns, columns=p1.columns
-        ).reset_index(names=['source']).melt(
-            id_vars=['source'], var_name='target', value_name=name
-        )
+        n0, n1 = flow.shape
+        df = pd.DataFrame({
+            'source': pd.Categorical.from_codes(
+                np.repeat(sources.codes, n1), dtype=sources.dtype
+            ),
+            'target': pd.Categorical.from_codes(
+                np.tile(targets.codes, n0), dtype=targets.dtype
+            ),
+            name: np.asarray(flow).ravel(),
+        })
         return df
     """
     # TODO
@@ -0,0 +1,86 @@
+import anndata as ad
+import numpy as np
+import pandas as pd
+from scrtt.models.trajectory import GenericOTModel
+
+
+def make_ot_model() -> GenericOTModel:
+    rng = np.random.default_rng(0)
+    cells = {t: [f'd{t}_{i}' for i in range(n)] for t, n in [(0, 5), (1, 4)]}
+    meta = pd.DataFrame(
+        {'day': [0] * 5 + [1] * 4}, index=cells[0] + cells[1]
+    )
+    tmap = ad.AnnData(rng.random((5, 4)))
+    tmap.obs_names = cells[0]
+    tmap.var_names = cells[1]
+    return GenericOTModel({(0, 1): tmap}, meta, 'day')
+
+
+def make_p(ot_model: GenericOTModel) -> ad.AnnData:
+    rng = np.random.default_rng(1)
+    # A subset of the t0 cells, in a different order than the coupling.
+    return ad.AnnData(pd.DataFrame(
+        rng.random((3, 2)),
+        index=['d0_4', 'd0_2', 'd0_0'],
+        columns=['u', 'v'],
+    ))
+
+
+def test_push_forward_both_norms():
+    ot_model = make_ot_model()
+    p = make_p(ot_model)
+    p_out, p_in = ot_model.push_forward_both_norms(p, p, 0, 1)
+    expected_out = ot_model.push_forward(p, 0, 1, norm_axis=1)
+    expected_in = ot_model.push_forward(p, 0, 1, norm_axis=0)
+    np.testing.assert_allclose(p_out.X, expected_out.X)
+    np.testing.assert_allclose(p_in.X, expected_in.X)
+    assert p_out.obs_names.equals(expected_out.obs_names)
+    assert p_in.var_names.equals(p.var_names)
+
+
+def test_push_forward_both_norms_matches_coupling():
+    ot_model = make_ot_model()
+    p = make_p(ot_model)
+    X = ot_model.get_coupling(0, 1).X
+    rows = [4, 2, 0]
+    x_out, x_in, obs_names = ot_model.push_forward_both_norms_array(
+        p.X, p.X, p.obs_names, 0, 1
+    )
+    row_norm = X / X.sum(1, keepdims=True)
+    col_norm = X / X.sum(0, keepdims=True)
+    np.testing.assert_allclose(x_out, row_norm[rows].T @ p.X)
+    np.testing.assert_allclose(x_in, col_norm[rows].T @ p.X)
+    assert obs_names.tolist() == ['d1_0', 'd1_1', 'd1_2', 'd1_3']
+
+
+def test_pull_back():
+    ot_model = make_ot_model()
+    X = ot_model.get_coupling(0, 1).X.copy()
+    p = ad.AnnData(pd.DataFrame(
+        np.arange(4.).reshape(2, 2), index=['d1_3', 'd1_1'], columns=['u', 'v']
+    ))
+    p0 = ot_model.pull_back(p, 0, 1, norm_axis=1)
+    row_norm = X / X.sum(1, keepdims=True)
+    np.testing.assert_allclose(p0.X, row_norm[:, [3, 1]] @ p.X)
+    assert p0.obs_names.tolist() == [f'd0_{i}' for i in range(5)]
+
+
+def test_couplings_not_modified():
+    ot_model = make_ot_model()
+    X = ot_model.get_coupling(0, 1).X.copy()
+    p = make_p(ot_model)
+    ot_model.push_forward(p, 0, 1, norm_axis=1)
+    ot_model.push_forward_both_norms(p, p, 0, 1)
+    p1 = ot_model.push_forward(p, 0, 1, norm_axis=0)
+    ot_model.pull_back(p1, 0, 1, norm_axis=0)
+    np.testing.assert_array_equal(ot_model.get_coupling(0, 1).X, X)
+
+
+def test_push_forward_both_norms_contiguous():
+    ot_model = make_ot_model()
+    p = make_p(ot_model)
+    x_out, x_in, _ = ot_model.push_forward_both_norms_array(
+        p.X, p.X, p.obs_names, 0, 1
+    )
+    for x in (x_out, x_in):
+        assert x.flags['C_CONTIGUOUS'] and x.base is None
@@ -0,0 +1,382 @@
+import anndata as ad
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import csr_matrix
+from scipy.special import xlogy
+from scipy.stats import entropy as scipy_entropy
+from scrtt.models.trajectory import GenericOTModel
+from scrtt.plotting import Sankey
+from scrtt.plotting.sankey import _entropy_from_sums, _expected_flow_entropy
+
+
+# Expected values follow the original Sankey flow definitions, computed with
+# couplings that are not modified in place. (The original push_forward
+# normalized the stored coupling of a GenericOTModel in place, so it gave
+# different inflows on this fixture.)
+EXPECTED_FLOWS = {
+    (0, 1): (
+        [0.25, 0.3055555556, 0.1111111111, 0.1666666667, 0.0,
+         0.1666666667, 0.0, 0.0, 0.0],
+        [0.2706766917, 0.3383458647, 0.1503759398, 0.0902255639, 0.0,
+         0.1503759398, 0.0, 0.0, 0.0],
+    ),
+    (1, 2): (
+        [0.0, 0.1666666667, 0.1666666667, 0.0, 0.2222222222,
+         0.1111111111, 0.0, 0.0, 0.3333333333],
+        [0.0, 0.1111111111, 0.1111111111, 0.0, 0.2222222222,
+         0.1666666667, 0.0, 0.0, 0.3888888889],
+    ),
+    (0, 2): (
+        [0.0, 0.3287037037, 0.337962963, 0.0, 0.0833333333,
+         0.25, 0.0, 0.0, 0.0],
+        [0.0, 0.3202033037, 0.4409148666, 0.0, 0.0304955527,
+         0.208386277, 0.0, 0.0, 0.0],
+    ),
+}
+EXPECTED_ENTROPY_INDEX = [
+    ('forward', 0, 1), ('forward', 0, 2), ('forward', 1, 2),
+    ('backward', 0, 1), ('backward', 0, 2), ('backward', 1, 2),
+]
+EXPECTED_ENTROPY = [
+    0.9137225404, 0.6494788661, 0.4432204496,
+    0.4114133396, 0.5110956604, 0.8519145854,
+]
+EXPECTED_PRIOR_ENTROPY = [
+    1.09581801, 0.6478781855, 0.6365141683,
+    0.6365141683, 0.6365141683, 1.0986122887,
+]
+EXPECTED_CONSISTENCY = [
+    (0, 1, 'forward', 0.25),
+    (0, 2, 'forward', 0.0833333333),
+    (1, 2, 'forward', 0.5555555556),
+    (0, 1, 'backward', 0.2706766917),
+    (0, 2, 'backward', 0.0304955527),
+    (1, 2, 'backward', 0.6111111111),
+]
+
+
+def make_ot_model() -> GenericOTModel:
+    n_cells = {0: 4, 1: 3, 2: 3}
+    cells = {
+        t: [f'd{t}_{i}' for i in range(n)] for t, n in n_cells.items()
+    }
+    meta = pd.DataFrame(
+        {'day': sum([[t] * n for t, n in n_cells.items()], [])},
+        index=sum(cells.values(), []),
+    )
+    couplings = {
+        (0, 1): np.array([[2., 1, 0], [0, 1, 1], [1, 0, 3], [1, 1, 1]]),
+        (1, 2): np.array([[1., 0, 2], [1, 2, 0], [0, 1, 1]]),
+    }
+    tmaps = dict()
+    for (t0, t1), X in couplings.items():
+        tmap = ad.AnnData(X)
+        tmap.obs_names = cells[t0]
+        tmap.var_names = cells[t1]
+        tmaps[(t0, t1)] = tmap
+    return GenericOTModel(tmaps, meta, 'day')
+
+
+def make_labels(ot_model: GenericOTModel) -> pd.Series:
+    # Subset 'c' is empty at day 0, and cell d0_3 has no subset.
+    return pd.Series(
+        ['a', 'b', 'a', None, 'b', 'c', 'a', 'c', 'c', 'b'],
+        index=ot_model.meta.index,
+    )
+
+
+def check_flows(flow_df: pd.DataFrame, day_pair):
+    flow_df = flow_df.astype({'source': str, 'target': str})
+    flow_df = flow_df.sort_values(['source', 'target'])
+    outflow, inflow = EXPECTED_FLOWS[day_pair]
+    np.testing.assert_allclose(flow_df['outflow'], outflow, atol=1e-9)
+    np.testing.assert_allclose(flow_df['inflow'], inflow, atol=1e-9)
+
+
+def test_calculate_flows():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model))
+    # (0, 2) resumes from the cached push forward of (0, 1).
+    for day_pair in [(0, 1), (1, 2), (0, 2)]:
+        check_flows(sankey.calculate_flows(*day_pair), day_pair)
+
+
+def test_calculate_flows_uncached():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model), cache_flow_dfs=False)
+    check_flows(sankey.calculate_flows(0, 2), (0, 2))
+
+
+def test_calculate_flows_dense_subsets():
+    ot_model = make_ot_model()
+    subsets = pd.get_dummies(make_labels(ot_model)).astype(float) * 0.5
+    sankey = Sankey(ot_model, subsets)
+    for day_pair in EXPECTED_FLOWS:
+        check_flows(sankey.calculate_flows(*day_pair), day_pair)
+
+
+def test_flow_metrics():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model))
+    for day_pair in EXPECTED_FLOWS:
+        sankey.calculate_flows(*day_pair)
+
+    entropy = sankey.compute_flow_entropy()
+    assert entropy.index.tolist() == EXPECTED_ENTROPY_INDEX
+    np.testing.assert_allclose(entropy['expected'], EXPECTED_ENTROPY)
+    np.testing.assert_allclose(entropy['prior'], EXPECTED_PRIOR_ENTROPY)
+
+    consistency = sankey.compute_flow_consistency()
+    assert consistency.columns.tolist() == [
+        'day_0', 'day_1', 'direction', 'consistency'
+    ]
+    assert [
+        tuple(row[:3]) for row in consistency.values.tolist()
+    ] == [row[:3] for row in EXPECTED_CONSISTENCY]
+    np.testing.assert_allclose(
+        consistency['consistency'], [row[3] for row in EXPECTED_CONSISTENCY]
+    )
+
+
+def test_flow_metrics_invalidated():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model))
+    for day_pair in EXPECTED_FLOWS:
+        sankey.calculate_flows(*day_pair)
+    entropy = sankey.compute_flow_entropy()
+
+    # Replacing a flow df directly invalidates the cached metrics.
+    flow_df = sankey.flow_dfs[(0, 1)]
+    sankey.flow_dfs[(0, 1)] = flow_df.assign(outflow=flow_df['inflow'])
+    new_consistency = sankey.compute_flow_consistency()
+    new_entropy = sankey.compute_flow_entropy()
+    forward = new_consistency['direction'] == 'forward'
+    np.testing.assert_allclose(
+        new_consistency.loc[forward, 'consistency'],
+        [0.2706766917, 0.0833333333, 0.5555555556],
+    )
+    assert not np.allclose(new_entropy['expected'], entropy['expected'])
+
+    del sankey.flow_dfs[(0, 1)]
+    assert len(sankey.compute_flow_consistency()) == 4
+    assert sankey.compute_flow_entropy().index.tolist() == [
+        ('forward', 0, 2), ('forward', 1, 2),
+        ('backward', 0, 2), ('backward', 1, 2),
+    ]
+
+    sankey.flow_dfs = {(0, 1): flow_df}
+    assert sankey.compute_flow_consistency()['consistency'].tolist() == \
+        pytest.approx([0.25, 0.2706766917])
+
+    # Results are copies, so callers cannot modify the cached metrics.
+    sankey.compute_flow_consistency()['consistency'] = 0.0
+    assert (sankey.compute_flow_consistency()['consistency'] > 0).all()
+
+
+def test_flow_metrics_cached():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model))
+    for day_pair in EXPECTED_FLOWS:
+        sankey.calculate_flows(*day_pair)
+
+    all_flows = sankey._all_flows
+    entropy = sankey.compute_flow_entropy()
+    consistency = sankey.compute_flow_consistency()
+    cached = dict(sankey._metrics_cache)
+    assert sankey._all_flows is all_flows
+    pd.testing.assert_frame_equal(sankey.compute_flow_entropy(), entropy)
+    pd.testing.assert_frame_equal(
+        sankey.compute_flow_consistency(), consistency
+    )
+    # Nothing was recomputed by the second calls.
+    for name, (version, metric) in sankey._metrics_cache.items():
+        assert cached[name][1] is metric
+
+    # Storing a new flow invalidates the combined frame.
+    sankey.flow_dfs.pop((0, 2))
+    sankey.calculate_flows(0, 2)
+    assert sankey._all_flows is not all_flows
+    pd.testing.assert_frame_equal(sankey.compute_flow_entropy(), entropy)
+
+
+def test_expected_flow_entropy():
+    rng = np.random.default_rng(0)
+    n_pairs, n_groups, n_rows = 3, 4, 60
+    pair_codes = rng.integers(n_pairs, size=n_rows)
+    group_codes = rng.integers(n_groups, size=n_rows)
+    flow = rng.random(n_rows)
+    flow[rng.random(n_rows) < 0.2] = 0
+    # Group 3 of pair 0 is empty.
+    flow[(pair_codes == 0) & (group_codes == 3)] = 0
+
+    entropy, sizes = _expected_flow_entropy(
+        pair_codes, n_pairs, group_codes, n_groups, flow
+    )
+    for i in range(n_pairs):
+        in_pair = pair_codes == i
+        expected = 0
+        for j in range(n_groups):
+            x = flow[in_pair & (group_codes == j)]
+            assert sizes[i, j] == pytest.approx(x.sum())
+            if x.sum() > 0:
+                expected += x.sum() * scipy_entropy(x)
+        assert entropy[i] == pytest.approx(expected / flow[in_pair].sum())
+
+
+def test_entropy_from_sums():
+    # Single-member groups have zero entropy, although for these sizes
+    # log(S) - x log(x) / S is a tiny negative number, and empty groups have
+    # zero entropy too.
+    x = np.array([4.294575996691774e-11, 1.3194014523853591e-08,
+                  0.0007316970214783208, 3.461664282091744, 0.0])
+    entropy = _entropy_from_sums(x, xlogy(x, x))
+    np.testing.assert_array_equal(entropy, 0.0)
+
+    x = np.array([0.5, 0.25, 0.25])
+    entropy = _entropy_from_sums(np.array([x.sum()]), [(x * np.log(x)).sum()])
+    np.testing.assert_allclose(entropy, [scipy_entropy(x)])
+
+
+def test_flow_entropy_order():
+    # Rows are forward then backward, each sorted by (t0, t1), whatever
+    # order the flows were calculated in.
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model))
+    for day_pair in [(1, 2), (0, 2), (0, 1)]:
+        sankey.calculate_flows(*day_pair)
+    entropy = sankey.compute_flow_entropy()
+    assert entropy.index.names == ['direction', 'day_0', 'day_1']
+    assert entropy.index.tolist() == EXPECTED_ENTROPY_INDEX
+    np.testing.assert_allclose(entropy['expected'], EXPECTED_ENTROPY)
+    np.testing.assert_allclose(entropy['prior'], EXPECTED_PRIOR_ENTROPY)
+
+
+def test_calculate_flows_empty_subsets():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model))
+    flow_df = sankey.calculate_flows(0, 1)
+    # Subset 'c' has no cells at day 0, so it is dropped from the push
+    # forward and padded back as zero flows.
+    from_c = flow_df['source'] == 'c'
+    assert from_c.sum() == 3
+    assert (flow_df.loc[from_c, ['outflow', 'inflow']] == 0).all(axis=None)
+    outflow, inflow, obs_names = sankey._pf_cache[(0, 1)]
+    assert outflow.shape == inflow.shape == (3, 2)
+    assert obs_names.tolist() == ['d1_0', 'd1_1', 'd1_2']
+
+    # At t1 == t0 the unlabelled cell d0_3 contributes no flow.
+    flow_df = sankey.calculate_flows(0, 0)
+    np.testing.assert_allclose(
+        flow_df['outflow'], [2 / 3, 0, 0, 0, 1 / 3, 0, 0, 0, 0]
+    )
+    np.testing.assert_allclose(flow_df['inflow'], flow_df['outflow'])
+
+
+def test_subsets_storage():
+    ot_model = make_ot_model()
+    labels = make_labels(ot_model)
+    one_hot = pd.get_dummies(labels).astype(float)
+    sankey = Sankey(ot_model, labels)
+    assert isinstance(sankey._subsets_matrix, csr_matrix)
+    assert 'subsets' not in vars(sankey)
+    pd.testing.assert_frame_equal(sankey.subsets, one_hot)
+
+    dense = Sankey(ot_model, one_hot * 0.5)
+    assert isinstance(dense._subsets_matrix, np.ndarray)
+    pd.testing.assert_frame_equal(dense.subsets, one_hot * 0.5)
+    assert dense._flow_cache_key(0, 1) != sankey._flow_cache_key(0, 1)
+
+
+def test_flow_labels_follow_group_order():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model), group_order=['c', 'a'])
+    flow_df = sankey.calculate_flows(0, 1)
+    for var in ('source', 'target'):
+        assert isinstance(flow_df[var].dtype, pd.CategoricalDtype)
+        assert flow_df[var].cat.categories.tolist() == ['c', 'a', 'b']
+    check_flows(flow_df, (0, 1))
+
+
+def test_plot_categorical_flows():
+    ot_model = make_ot_model()
+    sankey = Sankey(ot_model, make_labels(ot_model), group_order=['c', 'a', 'b'])
+    fig, ax = plt.subplots()
+    try:
+        ax_out = sankey.plot_sankey(0, 2, ax=ax, endpoint_width=0.05)
+        assert ax_out is ax
+    finally:
+        plt.close(fig)
+    fig = sankey.plot_all_transitions(show_labels=True)
+    try:
+        assert set(sankey.flow_dfs) == {(0, 1), (1, 2), (0, 2)}
+    finally:
+        plt.close(fig)
+
+
+def test_disk_cache(tmp_path):
+    ot_model = make_ot_model()
+    labels = make_labels(ot_model)
+    sankey = Sankey(ot_model, labels, cache_dir=tmp_path)
+    check_flows(sankey.calculate_flows(0, 1), (0, 1))
+    assert len(list(tmp_path.iterdir())) == 1
+    assert sankey._pf_cache
+
+    # A hit loads the flows without pushing anything forward.
+    sankey = Sankey(ot_model, labels, cache_dir=tmp_path)
+    check_flows(sankey.calculate_flows(0, 1), (0, 1))
+    assert (0, 1) in sankey.flow_dfs
+    assert not sankey._pf_cache
+
+    sankey = Sankey(
+        ot_model, labels, group_order=['c', 'b', 'a'], cache_dir=tmp_path
+    )
+    flow_df = sankey.calculate_flows(0, 1)
+    assert not sankey._pf_cache
+    assert flow_df['source'].cat.categories.tolist() == ['c', 'b', 'a']
+    assert flow_df['target'].cat.categories.tolist() == ['c', 'b', 'a']
+    check_flows(flow_df, (0, 1))
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_disk_cache_key():
+    ot_model = make_ot_model()
+    labels = make_labels(ot_model)
+    sankey = Sankey(ot_model, labels)
+    key = sankey._flow_cache_key(0, 2)
+    for t0, t1 in [(np.int64(0), np.int64(2)), (0, 2.0), (0.0, np.float64(2))]:
+        assert sankey._flow_cache_key(t0, t1) == key
+    assert sankey._flow_cache_key(0, 1) != key
+
+    # Different couplings give different keys.
+    other_model = make_ot_model()
+    other_model.tmaps[(1, 2)].X[0, 0] += 1
+    assert Sankey(other_model, labels)._flow_cache_key(0, 2) != key
+    assert Sankey(other_model, labels)._flow_cache_key(0, 1) == \
+        sankey._flow_cache_key(0, 1)
+
+
+def test_plot_all_transitions_threaded():
+    ot_model = make_ot_model()
+    labels = make_labels(ot_model)
+    sequential = Sankey(ot_model, labels)
+    for day_pair in ot_model.day_pairs:
+        sequential.calculate_flows(*day_pair)
+
+    threaded = Sankey(ot_model, labels)
+    fig = threaded.plot_all_transitions(n_jobs=2)
+    plt.close(fig)
+    assert set(threaded.flow_dfs) == set(sequential.flow_dfs)
+    for day_pair, flow_df in sequential.flow_dfs.items():
+        pd.testing.assert_frame_equal(threaded.flow_dfs[day_pair], flow_df)
+    assert set(threaded._pf_cache) == set(sequential._pf_cache)
+    for key, arrays in sequential._pf_cache.items():
+        for x, y in zip(threaded._pf_cache[key], arrays):
+            np.testing.assert_array_equal(x, y)
+
+    uncached = Sankey(ot_model, labels, cache_flow_dfs=False)
+    with pytest.raises(ValueError):
+        uncached.plot_all_transitions(n_jobs=2)